@@ -0,0 +1,503 @@
+/* Optional C accelerator for the line-level trace callback.
+ *
+ * Exposes a `Tracer` type that registers itself through PyEval_SetTrace so
+ * that line events never enter a Python-level callback. Statistics are kept
+ * in a C hash map keyed by the PyCodeObject pointer (identity compare, no
+ * tuple hashing) with per-line {hits, total_ns} cells, and are only copied
+ * into Python objects when snapshot() is called.
+ *
+ * Build out-of-band, e.g.:
+ *   cc -shared -fPIC -O2 $(python3-config --includes) \
+ *      lineprofiler/_ctrace.c -o lineprofiler/_ctrace$(python3-config --extension-suffix)
+ *
+ * PyEval_SetTrace only registers for the calling thread, so profiler.py
+ * points threading.settrace at install(), which re-registers the tracer
+ * from inside each newly spawned thread. Per-thread call stacks live in a
+ * GIL-protected linked list keyed by the thread ident; the counter map is
+ * shared, as the GIL serializes trace callbacks.
+ *
+ * The pure-Python callback in profiler.py remains the fallback when this
+ * module is not compiled.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <frameobject.h>
+
+#include <stdint.h>
+#include <string.h>
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
+static inline int64_t
+now_ns(void)
+{
+#ifdef _WIN32
+    LARGE_INTEGER counter, freq;
+    QueryPerformanceCounter(&counter);
+    QueryPerformanceFrequency(&freq);
+    return (int64_t)(counter.QuadPart * (1000000000.0 / freq.QuadPart));
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (int64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+#endif
+}
+
+typedef struct {
+    int64_t hits;
+    int64_t total_ns;
+} LineCell;
+
+typedef struct CodeEntry {
+    PyCodeObject *code;     /* strong reference */
+    int allowed;            /* project-folder filter decision, cached */
+    int first_line;
+    Py_ssize_t n_cells;     /* capacity of cells, indexed by lineno - first_line */
+    LineCell *cells;
+    int64_t calls;
+    int64_t total_ns;
+    struct CodeEntry *next; /* hash chain */
+} CodeEntry;
+
+#define N_BUCKETS 1024      /* power of two */
+
+typedef struct {
+    CodeEntry *entry;       /* NULL for frames that are filtered out */
+    int last_line;          /* -1 before the first line event of the frame */
+    int64_t last_ns;
+} StackSlot;
+
+typedef struct ThreadState {
+    unsigned long ident;
+    StackSlot *stack;
+    Py_ssize_t stack_size;
+    Py_ssize_t stack_cap;
+    CodeEntry *current;
+    int last_line;
+    int64_t last_ns;
+    struct ThreadState *next;
+} ThreadState;
+
+typedef struct {
+    PyObject_HEAD
+    CodeEntry *buckets[N_BUCKETS];
+    PyObject *filter;       /* callable(filename: str) -> bool */
+    ThreadState *threads;   /* one per thread seen, GIL-protected */
+    ThreadState *cached;    /* last state looked up, fast path */
+    int active;
+} TracerObject;
+
+static inline size_t
+bucket_of(PyCodeObject *code)
+{
+    return ((uintptr_t)code * (uintptr_t)2654435761u) & (N_BUCKETS - 1);
+}
+
+static CodeEntry *
+tracer_find_entry(TracerObject *self, PyCodeObject *code)
+{
+    CodeEntry *entry = self->buckets[bucket_of(code)];
+    while (entry != NULL && entry->code != code) {
+        entry = entry->next;
+    }
+    return entry;
+}
+
+static CodeEntry *
+tracer_add_entry(TracerObject *self, PyCodeObject *code)
+{
+    CodeEntry *entry = PyMem_Calloc(1, sizeof(CodeEntry));
+    if (entry == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    Py_INCREF(code);
+    entry->code = code;
+    entry->first_line = code->co_firstlineno;
+
+    PyObject *verdict = PyObject_CallFunctionObjArgs(self->filter, code->co_filename, NULL);
+    if (verdict == NULL) {
+        Py_DECREF(code);
+        PyMem_Free(entry);
+        return NULL;
+    }
+    entry->allowed = PyObject_IsTrue(verdict);
+    Py_DECREF(verdict);
+
+    size_t bucket = bucket_of(code);
+    entry->next = self->buckets[bucket];
+    self->buckets[bucket] = entry;
+    return entry;
+}
+
+static int
+entry_accumulate(CodeEntry *entry, int lineno, int64_t delta_ns)
+{
+    Py_ssize_t idx = lineno - entry->first_line;
+    if (idx < 0) {
+        return 0;
+    }
+    if (idx >= entry->n_cells) {
+        Py_ssize_t new_cap = entry->n_cells ? entry->n_cells : 16;
+        while (idx >= new_cap) {
+            new_cap *= 2;
+        }
+        LineCell *cells = PyMem_Realloc(entry->cells, new_cap * sizeof(LineCell));
+        if (cells == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        memset(cells + entry->n_cells, 0, (new_cap - entry->n_cells) * sizeof(LineCell));
+        entry->cells = cells;
+        entry->n_cells = new_cap;
+    }
+    entry->cells[idx].hits += 1;
+    entry->cells[idx].total_ns += delta_ns;
+    entry->total_ns += delta_ns;
+    return 0;
+}
+
+static int
+tracer_push(ThreadState *ts)
+{
+    if (ts->stack_size >= ts->stack_cap) {
+        Py_ssize_t new_cap = ts->stack_cap ? ts->stack_cap * 2 : 256;
+        StackSlot *stack = PyMem_Realloc(ts->stack, new_cap * sizeof(StackSlot));
+        if (stack == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        ts->stack = stack;
+        ts->stack_cap = new_cap;
+    }
+    StackSlot *slot = &ts->stack[ts->stack_size++];
+    slot->entry = ts->current;
+    slot->last_line = ts->last_line;
+    slot->last_ns = ts->last_ns;
+    return 0;
+}
+
+static ThreadState *
+tracer_thread_state(TracerObject *self)
+{
+    unsigned long ident = PyThread_get_thread_ident();
+    ThreadState *ts = self->cached;
+    if (ts != NULL && ts->ident == ident) {
+        return ts;
+    }
+    for (ts = self->threads; ts != NULL; ts = ts->next) {
+        if (ts->ident == ident) {
+            self->cached = ts;
+            return ts;
+        }
+    }
+    ts = PyMem_Calloc(1, sizeof(ThreadState));
+    if (ts == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    ts->ident = ident;
+    ts->last_line = -1;
+    ts->next = self->threads;
+    self->threads = ts;
+    self->cached = ts;
+    return ts;
+}
+
+static int
+trace_c(PyObject *obj, PyFrameObject *frame, int what, PyObject *arg)
+{
+    TracerObject *self = (TracerObject *)obj;
+    (void)arg;
+
+    if (!self->active) {
+        /* stop() only deregisters the calling thread; other threads keep
+         * delivering events until they exit, so make those no-ops. */
+        return 0;
+    }
+    ThreadState *ts = tracer_thread_state(self);
+    if (ts == NULL) {
+        return -1;
+    }
+
+    switch (what) {
+    case PyTrace_CALL: {
+        PyCodeObject *code = PyFrame_GetCode(frame);
+        CodeEntry *entry = tracer_find_entry(self, code);
+        if (entry == NULL) {
+            entry = tracer_add_entry(self, code);
+            if (entry == NULL) {
+                Py_DECREF(code);
+                return -1;
+            }
+        }
+        Py_DECREF(code);
+        if (tracer_push(ts) < 0) {
+            return -1;
+        }
+        if (entry->allowed) {
+            entry->calls += 1;
+            ts->current = entry;
+            ts->last_line = -1;
+            ts->last_ns = now_ns();
+        }
+        else {
+            /* Leave last_line/last_ns untouched: the caller's pending line
+             * keeps accruing through the filtered callee, matching the
+             * Python callback's per-frame opt-out. */
+            ts->current = NULL;
+        }
+        break;
+    }
+    case PyTrace_LINE: {
+        CodeEntry *entry = ts->current;
+        if (entry != NULL) {
+            int64_t now = now_ns();
+            if (ts->last_line >= 0
+                    && entry_accumulate(entry, ts->last_line, now - ts->last_ns) < 0) {
+                return -1;
+            }
+            ts->last_line = PyFrame_GetLineNumber(frame);
+            ts->last_ns = now;
+        }
+        break;
+    }
+    case PyTrace_RETURN: {
+        CodeEntry *entry = ts->current;
+        if (entry != NULL) {
+            int64_t now = now_ns();
+            if (ts->last_line >= 0
+                    && entry_accumulate(entry, ts->last_line, now - ts->last_ns) < 0) {
+                return -1;
+            }
+            /* Charge the time spent in a profiled callee to the callee only */
+            ts->last_ns = now;
+        }
+        if (ts->stack_size > 0) {
+            StackSlot *slot = &ts->stack[--ts->stack_size];
+            ts->current = slot->entry;
+            ts->last_line = slot->last_line;
+            if (entry == NULL) {
+                /* Filtered callee: restore the caller's clock so its time
+                 * is charged to the calling line. */
+                ts->last_ns = slot->last_ns;
+            }
+        }
+        else {
+            ts->current = NULL;
+            ts->last_line = -1;
+        }
+        break;
+    }
+    default:
+        break;
+    }
+    return 0;
+}
+
+static void
+tracer_free_threads(TracerObject *self)
+{
+    ThreadState *ts = self->threads;
+    while (ts != NULL) {
+        ThreadState *next = ts->next;
+        PyMem_Free(ts->stack);
+        PyMem_Free(ts);
+        ts = next;
+    }
+    self->threads = NULL;
+    self->cached = NULL;
+}
+
+static PyObject *
+Tracer_start(TracerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    tracer_free_threads(self);
+    self->active = 1;
+    PyEval_SetTrace(trace_c, (PyObject *)self);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Tracer_install(TracerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    /* PyEval_SetTrace only affects the calling thread, so profiler.py calls
+     * this (via a threading.settrace bootstrap) from inside each thread
+     * spawned while the profiler is active. */
+    if (self->active) {
+        PyEval_SetTrace(trace_c, (PyObject *)self);
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Tracer_stop(TracerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    if (self->active) {
+        PyEval_SetTrace(NULL, NULL);
+        self->active = 0;
+    }
+    Py_RETURN_NONE;
+}
+
+static void
+tracer_free_entries(TracerObject *self)
+{
+    for (size_t i = 0; i < N_BUCKETS; i++) {
+        CodeEntry *entry = self->buckets[i];
+        while (entry != NULL) {
+            CodeEntry *next = entry->next;
+            Py_DECREF(entry->code);
+            PyMem_Free(entry->cells);
+            PyMem_Free(entry);
+            entry = next;
+        }
+        self->buckets[i] = NULL;
+    }
+}
+
+static PyObject *
+Tracer_clear(TracerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    tracer_free_entries(self);
+    tracer_free_threads(self);
+    Py_RETURN_NONE;
+}
+
+/* Return [(code, calls, total_ns, {lineno: (hits, total_ns)}), ...] for every
+ * code object that passed the project filter and recorded at least one line. */
+static PyObject *
+Tracer_snapshot(TracerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    PyObject *result = PyList_New(0);
+    if (result == NULL) {
+        return NULL;
+    }
+    for (size_t i = 0; i < N_BUCKETS; i++) {
+        for (CodeEntry *entry = self->buckets[i]; entry != NULL; entry = entry->next) {
+            if (!entry->allowed || entry->cells == NULL) {
+                continue;
+            }
+            PyObject *lines = PyDict_New();
+            if (lines == NULL) {
+                goto error;
+            }
+            for (Py_ssize_t idx = 0; idx < entry->n_cells; idx++) {
+                LineCell *cell = &entry->cells[idx];
+                if (cell->hits == 0) {
+                    continue;
+                }
+                PyObject *key = PyLong_FromSsize_t(entry->first_line + idx);
+                PyObject *value = key ? Py_BuildValue("(LL)", (long long)cell->hits,
+                                                      (long long)cell->total_ns)
+                                      : NULL;
+                int failed = (value == NULL || PyDict_SetItem(lines, key, value) < 0);
+                Py_XDECREF(key);
+                Py_XDECREF(value);
+                if (failed) {
+                    Py_DECREF(lines);
+                    goto error;
+                }
+            }
+            PyObject *item = Py_BuildValue("(OLLN)", (PyObject *)entry->code,
+                                           (long long)entry->calls,
+                                           (long long)entry->total_ns, lines);
+            if (item == NULL || PyList_Append(result, item) < 0) {
+                Py_XDECREF(item);
+                goto error;
+            }
+            Py_DECREF(item);
+        }
+    }
+    return result;
+
+error:
+    Py_DECREF(result);
+    return NULL;
+}
+
+static int
+Tracer_init(TracerObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *keywords[] = {"filter", NULL};
+    PyObject *filter;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O", keywords, &filter)) {
+        return -1;
+    }
+    if (!PyCallable_Check(filter)) {
+        PyErr_SetString(PyExc_TypeError, "filter must be callable");
+        return -1;
+    }
+    Py_INCREF(filter);
+    Py_XSETREF(self->filter, filter);
+    return 0;
+}
+
+static void
+Tracer_dealloc(TracerObject *self)
+{
+    if (self->active) {
+        PyEval_SetTrace(NULL, NULL);
+    }
+    tracer_free_entries(self);
+    tracer_free_threads(self);
+    Py_XDECREF(self->filter);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyMethodDef Tracer_methods[] = {
+    {"start", (PyCFunction)Tracer_start, METH_NOARGS,
+     "Reset per-thread state and register the tracer for the current thread."},
+    {"install", (PyCFunction)Tracer_install, METH_NOARGS,
+     "Register the tracer for the calling thread (used for spawned threads)."},
+    {"stop", (PyCFunction)Tracer_stop, METH_NOARGS,
+     "Unregister the tracer."},
+    {"clear", (PyCFunction)Tracer_clear, METH_NOARGS,
+     "Drop all collected statistics."},
+    {"snapshot", (PyCFunction)Tracer_snapshot, METH_NOARGS,
+     "Return [(code, calls, total_ns, {lineno: (hits, total_ns)}), ...]."},
+    {NULL, NULL, 0, NULL},
+};
+
+static PyTypeObject TracerType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "lineprofiler._ctrace.Tracer",
+    .tp_basicsize = sizeof(TracerObject),
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Line tracer implemented in C via PyEval_SetTrace.",
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc)Tracer_init,
+    .tp_dealloc = (destructor)Tracer_dealloc,
+    .tp_methods = Tracer_methods,
+};
+
+static struct PyModuleDef ctrace_module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "lineprofiler._ctrace",
+    .m_doc = "C accelerator for LineProfiler's trace callback.",
+    .m_size = -1,
+};
+
+PyMODINIT_FUNC
+PyInit__ctrace(void)
+{
+    if (PyType_Ready(&TracerType) < 0) {
+        return NULL;
+    }
+    PyObject *module = PyModule_Create(&ctrace_module);
+    if (module == NULL) {
+        return NULL;
+    }
+    Py_INCREF(&TracerType);
+    if (PyModule_AddObject(module, "Tracer", (PyObject *)&TracerType) < 0) {
+        Py_DECREF(&TracerType);
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}